@@ -25,6 +25,8 @@ class CharLM:
 		self._order = n
 		self._logprobs = defaultdict(lambda: defaultdict(float))
 		self._smoothing = smoothing
+		# Number of n-grams scored by get_perplexity, for profiling.
+		self.scored_ngrams = 0
 
 	@staticmethod
 	def log(probability):
@@ -100,8 +102,10 @@ class CharLM:
 	def get_perplexity(self, sentence):
 		"""Compute the perplexity of @param sentence."""
 		log_probability = 0.0
-		for ngram in self._extract_ngrams(sentence):
+		ngrams = self._extract_ngrams(sentence)
+		for ngram in ngrams:
 			head, history = ngram[-1], ngram[:-1]
 			log_probability += self._logprobs[history][head]
+		self.scored_ngrams += len(ngrams)
 		# +1 in length for EOS_SYMBOL (see PCL2 Session 10, slide 48)
 		return self.perplexity(log_probability, len(sentence)+1)
@@ -28,6 +28,10 @@ class LanguageIdentifier:
         """List all language codes this identifier can handle."""
         return list(self._models.keys())
 
+    def count_scored_ngrams(self):
+        """Total number of n-grams scored by the models of this identifier."""
+        return sum(model.scored_ngrams for model in self._models.values())
+
     def add_model(self, language_code, model):
         """Add a language model to this identifier."""
         if language_code in self._models:
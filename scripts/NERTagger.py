@@ -6,9 +6,18 @@ import Levenshtein as lev
 import csv
 
 class EntityTagger:
+    TAG_NAMES = {'persons': 'personName', 'places': 'placeName'}
+
     def __init__(self, entity_directory):
         self.entity_directory = entity_directory
         self.entity_dicts = self.build_entity_dictionaries()
+        self.unigram_candidates = self._build_unigram_candidates()
+        # Hot-path counters (positions, ngrams, lev_distance_calls, exact_hits, fuzzy_hits,
+        # hot_set_hits, lev_distance_avoided), only collected when a profiling run sets this to a Counter
+        self.stats = None
+        # Entities resolved in the current document: cleaned n-gram -> (category, entity_id, lev_distance_calls)
+        self.hot_set = {}
+        self.document_id = None
 
     def build_entity_dictionaries(self):
         entity_counts = defaultdict(lambda: {'persons': 0, 'places': 0})
@@ -77,6 +86,14 @@ class EntityTagger:
         # Convert nested defaultdicts to regular dicts for return
         return {entity_type: {n: dict(v) for n, v in length_dicts.items()} for entity_type, length_dicts in entity_dicts.items()}
 
+    def start_document(self, document_id=None):
+        """
+        Start tagging a new document. The hot set of entities resolved in the
+        previous document, including fuzzily matched surface variants, is dropped.
+        """
+        self.hot_set = {}
+        self.document_id = document_id
+
     def _clean_text(self, text):
         text_list = text.split()
         #text_list[0] = text_list[0].lower()
@@ -85,101 +102,175 @@ class EntityTagger:
     def _is_proper_noun(self, word):
         return word[0].isupper() if word else False
 
-    def bio_tag(self, text):
-        # Split the text into a list of words for n-gram matching
-        text_list = text.split()
-        out_string = ''
-        # Initialize the skip_until variable to -1 to indicate that no words should be skipped
-        skip_until = -1
+    def _build_unigram_candidates(self):
+        # Lowercased unigrams in lookup order, so fuzzy matching does not lowercase them per call
+        return [(entity.lower(), entity_id, category)
+                for category in ['persons', 'places']
+                for entity, entity_id in self.entity_dicts.get(category, {}).get(1, {}).items()]
+
+    def _word_offsets(self, text):
+        # (start, end) of every word in text; the same words as text.split()
+        return [(match.start(), match.end()) for match in re.finditer(r'\S+', text)]
+
+    def find_entities(self, text):
+        """
+        Find person and place names in text.
+
+        Returns a list of (start, end, category, ref) spans over the original
+        text, where category is 'persons' or 'places' and ref is the entity ID
+        ('' if the dictionary has none). Punctuation ending a matched n-gram is
+        left outside the span.
+        """
+        return self._find_entities(text, self._word_offsets(text))
 
-        for pos in range(len(text_list)):
-            if pos < skip_until:
+    def _find_entities(self, text, offsets):
+        # Strip punctuation from every word once instead of once per n-gram
+        cleaned_words = [text[start:end].strip(string.punctuation) for start, end in offsets]
+        max_n = max(max(self.entity_dicts.get('persons', {}).keys(), default=0),
+                    max(self.entity_dicts.get('places', {}).keys(), default=0))
+        spans = []
+        pos = 0
+        skipped = 0
+
+        while pos < len(offsets):
+            match = self._match_at(cleaned_words, pos, max_n)
+            if not match:
+                pos += 1
                 continue
-            # Initialize the found variable to False to indicate that no n-gram has been found
-            found = False
-            n_ranges = range(max(max(self.entity_dicts['persons'].keys(), default=0), 
-                                max(self.entity_dicts['places'].keys(), default=0)), 0, -1)
-            for n in n_ranges:
-                if pos + n > len(text_list):
-                    continue
-                # Create the n-gram from the current position
-                ngram = ' '.join(text_list[pos:pos + n])
-                cleaned_ngram = self._clean_text(ngram)
-
-                persons_unigram = self.entity_dicts['persons'].get(1, {}).get(cleaned_ngram)
-                places_unigram = self.entity_dicts['places'].get(1, {}).get(cleaned_ngram)
-
-                # Initialize the closest_entity variable to None to indicate that no closest entity has been found and entity_id to None
-                closest_entity = None
-                entity_id = None
-                closest_distance = float('inf')
-
-                # If the n-gram is not a proper noun, skip it
-                if not self._is_proper_noun(cleaned_ngram):
-                    continue  
-                
-                # check unigrams for exact match, the n-gram should be at least 4 characters long
-                if n == 1 and len(cleaned_ngram) >= 4:
-                    exact_match = persons_unigram or places_unigram
-                    if not exact_match:
-                        other_category = 'persons' if persons_unigram else 'places'
-                        other_unigram = self.entity_dicts[other_category].get(1, {}).get(cleaned_ngram)
-                        if other_unigram:
-                            tag_name = 'personName' if other_category == 'persons' else 'placeName'
-                            punctuation = ngram[-1] if ngram[-1] in string.punctuation else ''
-                            if ngram[-1] in string.punctuation:
-                                out_string += f'<{tag_name} ref="{other_unigram}">{ngram[:-1]}</{tag_name}>{punctuation} '
-                            else:   
-                                out_string += f'<{tag_name} ref="{other_unigram}">{ngram}</{tag_name}> '
-                            skip_until = pos + n
-                            found = True
-                            break
-                        else:
-                            for category in ['persons', 'places']:
-                                for entity, entity_id in self.entity_dicts[category].get(n, {}).items():
-                                    distance = lev.distance(cleaned_ngram.lower(), entity.lower())
-                                    # if the n-gram is more than 5 characters, we want to match with a distance of 3 or less, this is a safe threshold
-                                    if len(cleaned_ngram) > 5:
-                                        if distance <= 1 and distance < closest_distance:
-                                            closest_entity = (entity, entity_id, category)
-                                            closest_distance = distance
-                                            closest_category = category
-                                    # if the n-gram is less than 5 characters, we only want to match exact strings, this avoids false positives
-                                    elif len(cleaned_ngram) <= 4:
-                                        if distance <= 0 and distance < closest_distance:
-                                            closest_entity = (entity, entity_id, category)
-                                            #print(closest_entity, "this is the closest entity for unigrams with 4 or less characters") SANITY CHECK
-                                            closest_distance = distance
-                                            closest_category = category
-
-                else:
-                    for category in ['persons', 'places']:
-                        for entity, entity_id in self.entity_dicts[category].get(n, {}).items():
-                            distance = lev.distance(cleaned_ngram.lower(), entity)
-                            if len(cleaned_ngram.split()[0]) <= 3:
-                                continue
-                            elif distance <= 3 and distance < closest_distance:
-                                closest_entity = (entity, entity_id, category)
-                                closest_distance = distance
-                                closest_category = category
-
-                if closest_entity:
-                    entity, entity_id, category = closest_entity
-                    tag_name = 'personName' if category == 'persons' else 'placeName'
-                    punctuation = ngram[-1] if ngram[-1] in string.punctuation else ''
-                    if ngram[-1] in string.punctuation:
-                        out_string += f'<{tag_name} ref="{entity_id}">{ngram[:-1]}</{tag_name}>{punctuation} ' if entity_id else f'<{tag_name}>{ngram[:-1]}</{tag_name}>{punctuation} '
-                    else:
-                        out_string += f'<{tag_name} ref="{entity_id}">{ngram}</{tag_name}> ' if entity_id else f'<{tag_name}>{ngram}</{tag_name}> '
-                    skip_until = pos + n
-                    found = True
-                    break  
-
-            if not found and pos >= skip_until:
-                out_string += ngram + ' '
-
-        return out_string.strip()
-    
+            n, category, entity_id = match
+            skipped += n - 1
+            start = offsets[pos][0]
+            end = offsets[pos + n - 1][1]
+            if text[end - 1] in string.punctuation:
+                end -= 1
+            spans.append((start, end, category, entity_id))
+            # Skip the words covered by the n-gram
+            pos += n
+        if self.stats is not None:
+            self.stats['positions'] += len(offsets) - skipped
+        return spans
+
+    def _match_at(self, cleaned_words, pos, max_n):
+        # Return (n, category, entity_id) of the longest n-gram starting at pos that matches an entity
+        first_word = cleaned_words[pos]
+        # If the n-gram is not a proper noun, skip it
+        if not self._is_proper_noun(first_word):
+            return None
+        stats = self.stats
+
+        for n in range(max_n, 0, -1):
+            if pos + n > len(cleaned_words):
+                continue
+            cleaned_ngram = ' '.join(cleaned_words[pos:pos + n])
+            if stats is not None:
+                stats['ngrams'] += 1
+
+            # An n-gram already resolved in this document resolves the same way again
+            hot_entity = self.hot_set.get(cleaned_ngram)
+            if hot_entity is not None:
+                category, entity_id, lev_distance_calls = hot_entity
+                if stats is not None:
+                    stats['hot_set_hits'] += 1
+                    stats['lev_distance_avoided'] += lev_distance_calls
+                return n, category, entity_id
+
+            closest_entity = None
+            closest_distance = float('inf')
+            lev_distance_calls = 0
+
+            # check unigrams for exact match, the n-gram should be at least 4 characters long
+            if n == 1 and len(cleaned_ngram) >= 4:
+                exact_match = (self.entity_dicts.get('persons', {}).get(1, {}).get(cleaned_ngram)
+                               or self.entity_dicts.get('places', {}).get(1, {}).get(cleaned_ngram))
+                # if the n-gram is more than 5 characters, we want to match with a distance of 1 or less, this is a safe threshold
+                # if the n-gram is 4 characters, we only want to match exact strings, this avoids false positives
+                max_distance = 1 if len(cleaned_ngram) > 5 else 0 if len(cleaned_ngram) == 4 else None
+                if not exact_match and max_distance is not None:
+                    lowered_ngram = cleaned_ngram.lower()
+                    lev_distance_calls = len(self.unigram_candidates)
+                    for entity, entity_id, category in self.unigram_candidates:
+                        distance = lev.distance(lowered_ngram, entity)
+                        if distance <= max_distance and distance < closest_distance:
+                            closest_entity = (entity_id, category)
+                            closest_distance = distance
+
+            # the first word of longer n-grams must be more than 3 characters long
+            elif len(first_word) > 3:
+                lowered_ngram = cleaned_ngram.lower()
+                for category in ['persons', 'places']:
+                    lev_distance_calls += len(self.entity_dicts.get(category, {}).get(n, {}))
+                    for entity, entity_id in self.entity_dicts.get(category, {}).get(n, {}).items():
+                        distance = lev.distance(lowered_ngram, entity)
+                        if distance <= 3 and distance < closest_distance:
+                            closest_entity = (entity_id, category)
+                            closest_distance = distance
+
+            if stats is not None:
+                stats['lev_distance_calls'] += lev_distance_calls
+            if closest_entity:
+                entity_id, category = closest_entity
+                if stats is not None:
+                    stats['exact_hits' if closest_distance == 0 else 'fuzzy_hits'] += 1
+                self.hot_set[cleaned_ngram] = (category, entity_id, lev_distance_calls)
+                return n, category, entity_id
+        return None
+
+    def markup_pieces(self, text, spans):
+        """
+        Yield the serialized form of text with spans from `find_entities` as
+        (string, category, ref) pieces. Text outside entities has category None.
+        """
+        return self._markup_pieces(text, self._word_offsets(text), spans)
+
+    def _markup_pieces(self, text, offsets, spans):
+        # Words are joined by single spaces, entity n-grams become their own piece
+        plain = []
+        span_index = 0
+        pos = 0
+
+        while pos < len(offsets):
+            if pos > 0:
+                plain.append(' ')
+            start, end = offsets[pos]
+            if span_index < len(spans) and spans[span_index][0] == start:
+                _, span_end, category, entity_id = spans[span_index]
+                span_index += 1
+                last = pos
+                while offsets[last][1] < span_end:
+                    last += 1
+                words = [text[word_start:word_end] for word_start, word_end in offsets[pos:last]]
+                words.append(text[offsets[last][0]:span_end])
+                if plain:
+                    yield ''.join(plain), None, None
+                    plain = []
+                yield ' '.join(words), category, entity_id
+                plain.append(text[span_end:offsets[last][1]])
+                pos = last + 1
+            else:
+                plain.append(text[start:end])
+                pos += 1
+        if plain:
+            yield ''.join(plain), None, None
+
+    def markup(self, text, spans):
+        """Serialize spans from `find_entities` as inline personName/placeName tags."""
+        return self._markup(text, self._word_offsets(text), spans)
+
+    def _markup(self, text, offsets, spans):
+        out = []
+        for piece, category, entity_id in self._markup_pieces(text, offsets, spans):
+            if category is None:
+                out.append(piece)
+            else:
+                tag_name = self.TAG_NAMES[category]
+                ref = f' ref="{entity_id}"' if entity_id else ''
+                out.append(f'<{tag_name}{ref}>{piece}</{tag_name}>')
+        return ''.join(out)
+
+    def bio_tag(self, text):
+        offsets = self._word_offsets(text)
+        return self._markup(text, offsets, self._find_entities(text, offsets))
+
 
 def main():
     entity_tagger = EntityTagger('entities')  
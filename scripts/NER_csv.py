@@ -1,83 +1,175 @@
 import os
 import csv
-import re
+import copy
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from lxml import etree
-from NERTagger import EntityTagger 
+from NERTagger import EntityTagger
+from corpus_pack import iter_inputs, letter_names
+
+# Tagger of a worker process, loaded once by _init_worker
+_worker_tagger = None
+
+def _init_worker(entity_directory):
+    global _worker_tagger
+    _worker_tagger = EntityTagger(entity_directory)
+
+def _tag_sentences(tagger, sentences):
+    # sentences are (filename, sentence) pairs; the tagger's hot set is kept per letter
+    tagged_sentences = []
+    for filename, sentence in sentences:
+        if filename != tagger.document_id:
+            tagger.start_document(filename)
+        tagged_sentences.append(tagger.bio_tag(sentence))
+    return tagged_sentences
+
+def _tag_chunk(sentences):
+    return _tag_sentences(_worker_tagger, sentences)
+
+def _sentences(chunk):
+    return [(row.get('Filename'), row['Sentence']) for row in chunk]
+
+def tagger_label(tagged_sentence):
+    # Checking if the tagged sentence contains person or place names.
+    if '<' + EntityTagger.TAG_NAMES['persons'] in tagged_sentence:
+        return 'contains_person'
+    elif '<' + EntityTagger.TAG_NAMES['places'] in tagged_sentence:
+        return 'contains_place'
+    return 'no_entity'
 
 class SentenceExtractor:
     def __init__(self, entity_directory, input_directory, exclude_directory):
-        self.entity_tagger = EntityTagger(entity_directory)
+        self.entity_directory = entity_directory
         self.input_directory = input_directory
         self.exclude_directory = exclude_directory
         self.namespaces = {'tei': 'http://www.tei-c.org/ns/1.0'}
+        self._entity_tagger = None
 
-    def extract_sentences(self, output_file):
-        excluded_files = set(os.listdir(self.exclude_directory))
+    @property
+    def entity_tagger(self):
+        # Only loaded when tagging in this process; worker processes load their own
+        if self._entity_tagger is None:
+            self._entity_tagger = EntityTagger(self.entity_directory)
+        return self._entity_tagger
+
+    def sentence_markup(self, sentence):
+        """The markup of a <s> element and its tail, without the <s> and <lb/> tags."""
+        sentence = copy.deepcopy(sentence)
+        etree.strip_elements(sentence, '{*}lb', with_tail=False)
+        markup = etree.tostring(sentence, encoding='unicode')
+        # Cut the <s> start and end tags out of the serialized element; its tail follows the end tag
+        content_start = markup.index('>') + 1
+        if markup[content_start - 2] == '/':
+            return markup[content_start:].strip()
+        content_end = markup.rindex('</')
+        return (markup[content_start:content_end] + markup[markup.index('>', content_end) + 1:]).strip()
+
+    def iter_sentences(self):
+        """Yield a [sentence, label, sentence number, filename] row for every gold sentence, one letter at a time."""
+        # Both directories may also be corpus packs written by corpus_pack.py
+        excluded_files = set(letter_names(self.exclude_directory))
+
+        for filename, letter in iter_inputs(self.input_directory):
+            if filename not in excluded_files:
+                tree = etree.parse(letter)
+
+                for sentence in tree.xpath('//tei:s[not(ancestor::tei:note) and not(child::tei:note)]', namespaces=self.namespaces):
+                    sentence_num = sentence.get('n')
+                    cleaned_sentence_str = self.sentence_markup(sentence)
 
+                    if not ('<persName type="auto_name"' in cleaned_sentence_str or '<placeName type="auto_name"' in cleaned_sentence_str):
+                        if '<persName' in cleaned_sentence_str:
+                            label = 'contains_person'
+                        elif '<placeName' in cleaned_sentence_str:
+                            label = 'contains_place'
+                        else:
+                            label = 'no_entity'
+
+                        yield [cleaned_sentence_str, label, sentence_num, filename]
+
+    def extract_sentences(self, output_file):
         with open(output_file, 'w', encoding='utf-8', newline='') as csv_file:
             writer = csv.writer(csv_file)
             writer.writerow(['Sentence', 'Label', 'Sentence Number', 'Filename'])
+            writer.writerows(self.iter_sentences())
 
-            for filename in os.listdir(self.input_directory):
-                if filename.endswith('.xml') and filename not in excluded_files:
-                    file_path = os.path.join(self.input_directory, filename)
-                    tree = etree.parse(file_path)
-
-                    for sentence in tree.xpath('//tei:s[not(ancestor::tei:note) and not(child::tei:note)]', namespaces=self.namespaces):
-                        sentence_num = sentence.get('n')
-                        sentence_str = etree.tostring(sentence, encoding='unicode', method='xml')
-                        cleaned_sentence_str = re.sub(r'<\/?s[^>]*>', '', sentence_str).strip()
-                        cleaned_sentence_str = re.sub(r'<lb[^>]*\/>', '', cleaned_sentence_str).strip()
-
-                        if not ('<persName type="auto_name"' in cleaned_sentence_str or '<placeName type="auto_name"' in cleaned_sentence_str):
-                            if '<persName' in cleaned_sentence_str:
-                                label = 'contains_person'
-                            elif '<placeName' in cleaned_sentence_str:
-                                label = 'contains_place'
-                            else:
-                                label = 'no_entity'
-
-                            writer.writerow([cleaned_sentence_str, label, sentence_num, filename])
-
-    def add_tagged_sentences_to_csv(self, input_csv, output_csv):
-        data_rows = []
+    def _read_rows(self, input_csv):
         with open(input_csv, mode='r', encoding='utf-8') as infile:
             reader = csv.DictReader(infile)
             for row in reader:
                 # Excluding sentences containing auto_name types in original Sentence
                 if '<personName type="auto_name"' not in row['Sentence'] and '<placeName type="auto_name"' not in row['Sentence']:
-                    data_rows.append(row)
+                    yield row
 
-        with open(output_csv, mode='w', encoding='utf-8', newline='') as outfile:
-            fieldnames = reader.fieldnames + ['Tagged Sentence', 'My Tagger Entity']
-            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-            writer.writeheader()
+    def _tagged_chunks(self, rows, processes, chunksize):
+        # Yield (rows, tagged sentences) per chunk, in input order
+        chunks = iter(lambda: list(islice(rows, chunksize)), [])
+        workers = processes or os.cpu_count() or 1
+        if workers == 1:
+            for chunk in chunks:
+                yield chunk, _tag_sentences(self.entity_tagger, _sentences(chunk))
+            return
 
-            for row in data_rows:
-                original_sentence = row['Sentence']
-                # Assuming bio_tag correctly tags the sentence, it should be:
-                tagged_sentence = self.entity_tagger.bio_tag(original_sentence)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.entity_directory,)) as executor:
+            # Keep only a few chunks per worker in flight, so memory stays bounded by the chunk size
+            window = 2 * workers
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(_tag_chunk, _sentences(chunk))))
+                if len(pending) >= window:
+                    chunk, future = pending.popleft()
+                    yield chunk, future.result()
+            while pending:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+
+    def tagged_rows(self, input_csv, processes=None, chunksize=500):
+        """
+        Yield the rows of input_csv with the 'Tagged Sentence' and 'My Tagger Entity'
+        columns added, e.g. for evaluation.evaluate_rows without writing another CSV.
+        Sentences are tagged in chunks of chunksize by a pool of processes workers
+        (default: one per CPU; 1 tags in this process), and rows come back in input order.
+        """
+        for chunk, tagged_sentences in self._tagged_chunks(self._read_rows(input_csv), processes, chunksize):
+            for row, tagged_sentence in zip(chunk, tagged_sentences):
                 row['Tagged Sentence'] = tagged_sentence  # Store the tagged sentence
-                
-                # Checking if the tagged sentence contains person or place names.
-                # Ensure these checks correctly identify whether tags are present.
-                if '<persName' in tagged_sentence:
-                    row['My Tagger Entity'] = 'contains_person'
-                elif '<placeName' in tagged_sentence:
-                    row['My Tagger Entity'] = 'contains_place'
-                else:
-                    row['My Tagger Entity'] = 'no_entity'
-
-                writer.writerow(row)  # Write the modified row to the CSV
-
-
-entity_directory = 'entities'
-
- # this to get all the previously annotated letters to be reprocessed with the new tagger
-input_directory = '/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/calir-bullingerproject/gold_standard'
-extractor = SentenceExtractor(entity_directory, input_directory, exclude_directory="/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/calir-bullingerproject/<lb_files_corrected")
-output_file = 'extracted_sentences-ACCURACY.csv'  # Change as needed
-extractor.extract_sentences(output_file)
-input_csv = 'extracted_sentences-ACCURACY.csv'  # Change as needed
-output_csv = 'extracted_sentences-ACCURACY.csv'  # Change as needed
-extractor.add_tagged_sentences_to_csv(input_csv, output_csv)
+                row['My Tagger Entity'] = tagger_label(tagged_sentence)
+                yield row
+
+    def add_tagged_sentences_to_csv(self, input_csv, output_csv, processes=None, chunksize=500):
+        with open(input_csv, mode='r', encoding='utf-8') as infile:
+            fieldnames = csv.DictReader(infile).fieldnames + ['Tagged Sentence', 'My Tagger Entity']
+
+        # Write next to output_csv and move it into place at the end, so input_csv can be the same file
+        output_dir = os.path.dirname(os.path.abspath(output_csv))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', dir=output_dir,
+                                         suffix='.csv', delete=False) as outfile:
+            try:
+                writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+                writer.writeheader()
+                for row in self.tagged_rows(input_csv, processes, chunksize):
+                    writer.writerow(row)  # Write the modified row to the CSV
+            except BaseException:
+                outfile.close()
+                os.remove(outfile.name)
+                raise
+        # The temporary file is private (0600); give it the permissions of the file it replaces
+        shutil.copymode(output_csv if os.path.exists(output_csv) else input_csv, outfile.name)
+        os.replace(outfile.name, output_csv)
+
+
+if __name__ == "__main__":
+    entity_directory = 'entities'
+
+     # this to get all the previously annotated letters to be reprocessed with the new tagger
+    input_directory = '/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/calir-bullingerproject/gold_standard'
+    extractor = SentenceExtractor(entity_directory, input_directory, exclude_directory="/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/calir-bullingerproject/<lb_files_corrected")
+    output_file = 'extracted_sentences-ACCURACY.csv'  # Change as needed
+    extractor.extract_sentences(output_file)
+    input_csv = 'extracted_sentences-ACCURACY.csv'  # Change as needed
+    output_csv = 'extracted_sentences-ACCURACY.csv'  # Change as needed
+    extractor.add_tagged_sentences_to_csv(input_csv, output_csv)
@@ -0,0 +1,144 @@
+"""
+Persistent cache of tagged sentences shared across annotation runs.
+
+Two kinds of entries are kept. One maps (piece hash, gazetteer hash) to
+the entity spans of a sentence piece, the other maps (sentence markup
+hash, LM hash) to the language label of an assembled sentence. The markup
+already contains the entity tags, so re-annotating letters whose
+sentences did not change skips both entity matching and language
+identification.
+Reads and writes are batched per document: `prefetch` and
+`prefetch_languages` load all known entries of a letter in a few queries,
+`put` and `put_language` only buffer, and `flush` writes the buffered
+entries in one transaction.
+"""
+
+import hashlib
+import json
+import sqlite3
+
+
+def text_hash(text):
+    """Return a stable hex digest of @param text."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def file_fingerprint(paths, *extra):
+    """
+    Hash the contents of all files in @param paths together with any
+    @param extra values (e.g. model parameters) into one hex digest.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(1 << 20), b''):
+                digest.update(block)
+    for value in extra:
+        digest.update(repr(value).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SentenceCache:
+    """SQLite-backed store of entity spans and sentence languages."""
+
+    # SQLite limits the number of bound parameters per statement.
+    BATCH_SIZE = 500
+
+    def __init__(self, path, gazetteer_hash, lm_hash):
+        self.path = path
+        self.gazetteer_hash = gazetteer_hash
+        self.lm_hash = lm_hash
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS entity_spans ('
+            'sentence_hash TEXT, gazetteer_hash TEXT, spans TEXT, '
+            'PRIMARY KEY (sentence_hash, gazetteer_hash)) WITHOUT ROWID')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS sentence_languages ('
+            'markup_hash TEXT, lm_hash TEXT, language TEXT, '
+            'PRIMARY KEY (markup_hash, lm_hash)) WITHOUT ROWID')
+        self.connection.commit()
+        self._entries = {}
+        self._pending = {}
+        self._languages = {}
+        self._pending_languages = {}
+        self.hits = 0
+        self.misses = 0
+        self.language_hits = 0
+        self.language_misses = 0
+
+    def _select(self, query, key, hashes):
+        # Yield the rows of @param query for @param hashes, a batch of bound parameters at a time
+        for start in range(0, len(hashes), self.BATCH_SIZE):
+            batch = hashes[start:start + self.BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            yield from self.connection.execute(query.format(placeholders=placeholders), [key] + batch)
+
+    def prefetch(self, sentences):
+        """Load the cached results for all @param sentences of a document."""
+        wanted = list({text_hash(sentence) for sentence in sentences} - self._entries.keys())
+        rows = self._select('SELECT sentence_hash, spans FROM entity_spans '
+                            'WHERE gazetteer_hash = ? AND sentence_hash IN ({placeholders})',
+                            self.gazetteer_hash, wanted)
+        for sentence_hash, spans in rows:
+            self._entries[sentence_hash] = [tuple(span) for span in json.loads(spans)]
+
+    def prefetch_languages(self, markups):
+        """Load the cached languages for the sentence @param markups of a document."""
+        wanted = list({text_hash(markup) for markup in markups} - self._languages.keys())
+        rows = self._select('SELECT markup_hash, language FROM sentence_languages '
+                            'WHERE lm_hash = ? AND markup_hash IN ({placeholders})',
+                            self.lm_hash, wanted)
+        for markup_hash, language in rows:
+            self._languages[markup_hash] = language
+
+    def get(self, sentence):
+        """Return the cached entity spans of @param sentence, or None."""
+        result = self._entries.get(text_hash(sentence))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, sentence, spans):
+        """Buffer a new result; it is written on the next `flush`."""
+        sentence_hash = text_hash(sentence)
+        self._entries[sentence_hash] = spans
+        self._pending[sentence_hash] = spans
+
+    def get_language(self, markup):
+        """Return the cached language of the sentence serialized as @param markup, or None."""
+        result = self._languages.get(text_hash(markup))
+        if result is None:
+            self.language_misses += 1
+        else:
+            self.language_hits += 1
+        return result
+
+    def put_language(self, markup, language):
+        """Buffer a new language label; it is written on the next `flush`."""
+        markup_hash = text_hash(markup)
+        self._languages[markup_hash] = language
+        self._pending_languages[markup_hash] = language
+
+    def flush(self):
+        """Write all buffered results and forget the per-document entries."""
+        if self._pending:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO entity_spans VALUES (?, ?, ?)',
+                [(sentence_hash, self.gazetteer_hash, json.dumps(spans, ensure_ascii=False))
+                 for sentence_hash, spans in self._pending.items()])
+        if self._pending_languages:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO sentence_languages VALUES (?, ?, ?)',
+                [(markup_hash, self.lm_hash, language) for markup_hash, language in self._pending_languages.items()])
+        self.connection.commit()
+        self._pending = {}
+        self._entries = {}
+        self._pending_languages = {}
+        self._languages = {}
+
+    def close(self):
+        self.flush()
+        self.connection.close()
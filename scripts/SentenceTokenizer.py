@@ -1,98 +1,342 @@
 import os
-import re
+import json
+import argparse
+from collections import defaultdict
 from lxml import etree
-from nltk.tokenize import PunktSentenceTokenizer
+from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktTrainer, PunktParameters
 from identifier import LanguageIdentifier
 from charlm import CharLM
 #from lang_id.predict import LanguageIdentifier
 from scripts.NERTagger import EntityTagger
+from scripts.SentenceCache import SentenceCache, file_fingerprint
+from scripts.corpus_pack import iter_inputs, iter_documents
+from scripts.profiling import AnnotationProfiler, stage, timed_sentence
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LANG_DATA_DIR = os.path.join(REPO_DIR, 'lang_id', 'data')
+# Trained on <lb_files_corrected with scripts/train_punkt.py
+DEFAULT_PUNKT_MODEL = os.path.join(REPO_DIR, 'punkt', 'punkt_model.json')
 
 def preserve_lb_tags(paragraph):
+    """Flatten a paragraph into its text chunks and <lb> elements, in document order."""
     parts = []
-    for elem in paragraph.iter():
-        if elem.tag == 'lb':
-            parts.append(etree.tostring(elem, encoding='unicode', with_tail=False))
-        elif elem.text:
-            parts.append(elem.text)
-        if elem.tail:
+    for event, elem in etree.iterwalk(paragraph, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'lb':
+                parts.append(elem)
+            elif elem.text:
+                parts.append(elem.text)
+        # A tail follows the element's children
+        elif elem.tail:
             parts.append(elem.tail)
     return parts
 
-def train_language_models(datadir='/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/bullingerproject/lang_id/data', ngram_order=3, smoothing=0.1):
+def paragraph_text(text_chunks):
+    """
+    Join the text chunks of a paragraph into its text without <lb> elements.
+    Every <lb> becomes a newline, so words on either side stay apart. Returns
+    the text and a list of (offset, lb element) pairs.
+    """
+    parts = []
+    line_breaks = []
+    length = 0
+    for chunk in text_chunks:
+        if isinstance(chunk, str):
+            parts.append(chunk)
+            length += len(chunk)
+        else:
+            line_breaks.append((length, chunk))
+            parts.append('\n')
+            length += 1
+    return ''.join(parts), line_breaks
+
+def language_data_file(datadir, language_code):
+    # The data is shipped as DE.txt/LA.txt; accept both spellings on case-sensitive file systems
+    training_data = os.path.join(datadir, f'{language_code.lower()}.txt')
+    if not os.path.exists(training_data):
+        training_data = os.path.join(datadir, f'{language_code}.txt')
+    return training_data
+
+def train_language_models(datadir=DEFAULT_LANG_DATA_DIR, ngram_order=3, smoothing=0.1):
     identifier = LanguageIdentifier()
     for language_code in ['DE', 'LA']:
-        filename = f'{language_code.lower()}.txt'
-        training_data = os.path.join(datadir, filename)
+        training_data = language_data_file(datadir, language_code)
         model = CharLM(ngram_order, smoothing)
         model.train(training_data)
         identifier.add_model(language_code, model)
     return identifier
 
-global_language_identifier = train_language_models('/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/bullingerproject/lang_id/data')
+def train_punkt_model(documents):
+    """Train Punkt parameters on the paragraphs of @param documents (parsed letters)."""
+    trainer = PunktTrainer()
+    for doc in documents:
+        for paragraph in doc.xpath('//div/p'):
+            trainer.train(paragraph_text(preserve_lb_tags(paragraph))[0], finalize=False)
+    trainer.finalize_training()
+    return trainer.get_params()
+
+def save_punkt_model(params, path):
+    model = {
+        'abbrev_types': sorted(params.abbrev_types),
+        'collocations': sorted(params.collocations),
+        'sent_starters': sorted(params.sent_starters),
+        'ortho_context': dict(sorted(params.ortho_context.items())),
+    }
+    with open(path, 'w', encoding='utf-8') as outfile:
+        json.dump(model, outfile, ensure_ascii=False)
+
+def load_punkt_model(path):
+    with open(path, encoding='utf-8') as infile:
+        model = json.load(infile)
+    params = PunktParameters()
+    params.abbrev_types = set(model['abbrev_types'])
+    params.collocations = set(tuple(pair) for pair in model['collocations'])
+    params.sent_starters = set(model['sent_starters'])
+    params.ortho_context = defaultdict(int, model['ortho_context'])
+    return PunktSentenceTokenizer(params)
+
+global_language_identifier = None
+global_sentence_tokenizer = None
+
+def language_identifier():
+    # main() trains the models from --lang_data_dir; other callers get the shipped data, trained once
+    global global_language_identifier
+    if global_language_identifier is None:
+        global_language_identifier = train_language_models(DEFAULT_LANG_DATA_DIR)
+    return global_language_identifier
+
+def sentence_tokenizer():
+    # main() loads the model given with --punkt_model; other callers get the shipped corpus model, loaded once
+    global global_sentence_tokenizer
+    if global_sentence_tokenizer is None:
+        global_sentence_tokenizer = load_punkt_model(DEFAULT_PUNKT_MODEL)
+    return global_sentence_tokenizer
 
 def language_detection(text):
     if not text:
         return 'unk'
-    return global_language_identifier.identify(text).lower()
+    return language_identifier().identify(text).lower()
 
-def tokenize_and_preserve_structure(text_chunks, entity_tagger):
-    sent_tagged = []
-    sentence_num = 1
-    current_sentence = ''
-    tokenizer = PunktSentenceTokenizer()
+def segment_paragraph(text_chunks):
+    """
+    Split the text chunks of a paragraph into sentence pieces. The whole
+    paragraph is segmented in one Punkt call, and the <lb> elements are put
+    back at their offsets, splitting sentences into pieces. Returns a list of
+    (index, piece) pairs, where index is the number of the sentence a piece
+    starts, 0 for a piece continuing a sentence, or None for <lb> elements.
+    """
+    text, line_breaks = paragraph_text(text_chunks)
+    segments = []
+    lb_index = 0
 
-    for chunk in text_chunks:
-        parts = re.split(r'(\n+)', chunk)
-        for part in parts:
-            if part.strip() == '<lb/>':
-                current_sentence += part
-            elif part == '\n':
-                part = ""
-                current_sentence += part
-            else:
-                sentences = tokenizer.tokenize(part)
-                for i, sentence in enumerate(sentences):
-                    if r'<lb.*/>' in sentence:
-                        continue
-                    sentence_temp = sentence.split()
-                    tagged_sentence = entity_tagger.bio_tag(sentence)
-                    detected_language = language_detection(tagged_sentence)
-                    if i == 0:
-                        current_sentence += tagged_sentence
-                    else:
-                        if current_sentence:
-                            sent_tagged.append(f'<s n="{sentence_num}" xml:lang="{detected_language}">{current_sentence}</s>\n\t\t\t\t')
-                            sentence_num += 1
-                        current_sentence = tagged_sentence
+    for sentence_index, (start, end) in enumerate(sentence_tokenizer().span_tokenize(text)):
+        piece_index = sentence_index
+        while lb_index < len(line_breaks) and line_breaks[lb_index][0] < end:
+            offset, lb = line_breaks[lb_index]
+            piece = text[start:offset].strip()
+            if piece:
+                segments.append((piece_index, piece))
+                piece_index = 0
+            segments.append((None, lb))
+            start = max(start, offset + 1)
+            lb_index += 1
+        piece = text[start:end].strip()
+        if piece:
+            segments.append((piece_index, piece))
+    segments.extend((None, lb) for offset, lb in line_breaks[lb_index:])
+    return segments
+
+def tag_sentence(sentence, entity_tagger, cache=None, profiler=None):
+    """Return the entity spans of @param sentence, using @param cache if given."""
+    if cache is not None:
+        spans = cache.get(sentence)
+        if spans is not None:
+            return spans
+    with stage(profiler, 'bio_tag'):
+        spans = entity_tagger.find_entities(sentence)
+    if cache is not None:
+        cache.put(sentence, spans)
+    return spans
+
+def sentence_markup(pieces, entity_tagger):
+    """Serialize the pieces of a sentence the way they appear inside <s>."""
+    return ''.join(etree.tostring(piece, encoding='unicode', with_tail=False) if isinstance(piece, etree._Element)
+                   else entity_tagger.markup(*piece)
+                   for piece in pieces)
+
+def sentence_language(markup, cache=None, profiler=None):
+    """Return the language of the sentence serialized as @param markup, using @param cache if given."""
+    if cache is not None:
+        language = cache.get_language(markup)
+        if language is not None:
+            return language
+    # The language models score the tagged sentence
+    with stage(profiler, 'identify'):
+        language = language_detection(markup)
+    if cache is not None:
+        cache.put_language(markup, language)
+    return language
+
+def assemble_sentences(segments, entity_tagger, cache=None, profiler=None):
+    """
+    Group sentence pieces into sentences. Returns a list of sentences, each a
+    list of pieces, where every piece is an <lb> element or a (text, spans) pair.
+    """
+    sentences = []
+    current_sentence = []
+
+    for i, piece in segments:
+        if i is None:
+            current_sentence.append(piece)
+            continue
+        with timed_sentence(profiler, piece):
+            spans = tag_sentence(piece, entity_tagger, cache, profiler)
+        if i > 0:
+            # Line breaks right before a sentence start belong to the new sentence
+            line_breaks = []
+            while current_sentence and isinstance(current_sentence[-1], etree._Element):
+                line_breaks.insert(0, current_sentence.pop())
+            if current_sentence:
+                sentences.append(current_sentence)
+            current_sentence = line_breaks
+        # Pieces without words add nothing to the sentence
+        if piece.split():
+            current_sentence.append((piece, spans))
 
     if current_sentence:
-        detected_language = language_detection(current_sentence)
-        sent_tagged.append(f'<s n="{sentence_num}" xml:lang="{detected_language}">{current_sentence}</s>\n\t\t\t\t')
-    return ''.join(sent_tagged)
-
-def process_paragraphs(doc):
-    for paragraph in doc.xpath('//div/p'):
-        text_chunks = preserve_lb_tags(paragraph)
-        tagger = EntityTagger("entities")
-        sentences_str = tokenize_and_preserve_structure(text_chunks, tagger)
-        reconstruct_paragraph(sentences_str, paragraph)
-
-def reconstruct_paragraph(sentences_str, original_paragraph):
+        sentences.append(current_sentence)
+    return sentences
+
+def process_paragraphs(doc, entity_tagger=None, cache=None, profiler=None):
+    if entity_tagger is None:
+        entity_tagger = EntityTagger("entities")
+    entity_tagger.start_document()
+    paragraphs = doc.xpath('//div/p')
+    with stage(profiler, 'preserve_lb_tags'):
+        paragraph_chunks = [preserve_lb_tags(paragraph) for paragraph in paragraphs]
+    with stage(profiler, 'punkt'):
+        paragraph_segments = [segment_paragraph(chunks) for chunks in paragraph_chunks]
+    if cache is not None:
+        # One batched lookup for all sentences of the document
+        with stage(profiler, 'cache'):
+            cache.prefetch(piece for segments in paragraph_segments for i, piece in segments if i is not None)
+    with stage(profiler, 'assemble'):
+        paragraph_sentences = [assemble_sentences(segments, entity_tagger, cache, profiler)
+                               for segments in paragraph_segments]
+    with stage(profiler, 'identify'):
+        paragraph_markups = [[sentence_markup(pieces, entity_tagger) for pieces in sentences]
+                             for sentences in paragraph_sentences]
+    if cache is not None:
+        # Languages are cached by sentence markup, again in one lookup per document
+        with stage(profiler, 'cache'):
+            cache.prefetch_languages(markup for markups in paragraph_markups for markup in markups)
+    for paragraph, sentences, markups in zip(paragraphs, paragraph_sentences, paragraph_markups):
+        languages = [sentence_language(markup, cache, profiler) for markup in markups]
+        if profiler is not None:
+            profiler.count_sentences(len(sentences))
+        with stage(profiler, 'reconstruct'):
+            reconstruct_paragraph(zip(languages, sentences), paragraph, entity_tagger)
+    if cache is not None:
+        with stage(profiler, 'cache'):
+            cache.flush()
+
+def _append_text(parent, last_child, text):
+    # Add text after last_child, or as the text of parent if it has no children yet
+    if not text:
+        return
+    if last_child is None:
+        parent.text = (parent.text or '') + text
+    else:
+        last_child.tail = (last_child.tail or '') + text
+
+def reconstruct_paragraph(sentences, original_paragraph, entity_tagger):
+    """Replace the content of the paragraph with <s> elements built from @param sentences."""
     original_paragraph.clear()
-    new_content = etree.fromstring(f'<p>{sentences_str}</p>', etree.XMLParser(recover=True))
-    for child in new_content:
-        original_paragraph.append(child)
-
-def process_directory(input_dir, output_dir):
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.xml'):
-            input_file = os.path.join(input_dir, filename)
-            output_file = os.path.join(output_dir, filename)
-            doc = etree.parse(input_file)
-            process_paragraphs(doc)
+    for sentence_num, (language, pieces) in enumerate(sentences, start=1):
+        sentence_elem = etree.SubElement(original_paragraph, 's')
+        sentence_elem.set('n', str(sentence_num))
+        sentence_elem.set(XML_LANG, language)
+        sentence_elem.tail = '\n\t\t\t\t'
+        last_child = None
+        for piece in pieces:
+            if isinstance(piece, etree._Element):
+                # Move the original <lb>; its tail is already part of the sentence text
+                piece.tail = None
+                sentence_elem.append(piece)
+                last_child = piece
+                continue
+            for text, category, entity_id in entity_tagger.markup_pieces(*piece):
+                if category is None:
+                    _append_text(sentence_elem, last_child, text)
+                    continue
+                last_child = etree.SubElement(sentence_elem, EntityTagger.TAG_NAMES[category])
+                if entity_id:
+                    last_child.set('ref', entity_id)
+                last_child.text = text
+
+def process_directory(input_dir, output_dir, entity_dir='entities', cache=None, profile_dir=None):
+    entity_tagger = EntityTagger(entity_dir)
+    profiler = AnnotationProfiler(profile_dir, entity_tagger, language_identifier()) if profile_dir else None
+    # input_dir is a directory of letters or a pack written by scripts/corpus_pack.py
+    for filename, letter in iter_inputs(input_dir):
+        output_file = os.path.join(output_dir, filename)
+        if profiler is not None:
+            profiler.start_file(filename)
+        with stage(profiler, 'parse'):
+            doc = etree.parse(letter)
+        process_paragraphs(doc, entity_tagger, cache, profiler)
+        with stage(profiler, 'write'):
             doc.write(output_file, pretty_print=True, xml_declaration=True, encoding='UTF-8')
-            print(f'Processed and saved {filename}')
+        if profiler is not None:
+            profiler.finish_file()
+        print(f'Processed and saved {filename}')
+    if profiler is not None:
+        print(f'Profile summary written to {profiler.write_summary()}')
+
+def open_sentence_cache(cache_path, entity_dir, lang_data_dir=DEFAULT_LANG_DATA_DIR, ngram_order=3, smoothing=0.1):
+    """Open the cross-run cache, keyed by the current gazetteer and language model data."""
+    entity_files = [os.path.join(entity_dir, f'extracted_{entity_type}.txt') for entity_type in ['persons', 'places']]
+    gazetteer_hash = file_fingerprint([path for path in entity_files if os.path.exists(path)])
+    lm_files = [language_data_file(lang_data_dir, language_code) for language_code in ['DE', 'LA']]
+    lm_hash = file_fingerprint(lm_files, ngram_order, smoothing)
+    return SentenceCache(cache_path, gazetteer_hash, lm_hash)
+
+def main():
+    global global_language_identifier, global_sentence_tokenizer
+    parser = argparse.ArgumentParser(description='Annotate letters with sentences, languages and named entities.')
+    parser.add_argument('--input_dir', required=True, help='Directory or corpus pack containing the letters to annotate.')
+    parser.add_argument('--output_dir', required=True, help='Directory for the annotated letters.')
+    parser.add_argument('--lang_data_dir', default=DEFAULT_LANG_DATA_DIR, help='Directory with the language model training data.')
+    parser.add_argument('--entity_dir', default='entities', help='Directory containing the extracted entity files.')
+    parser.add_argument('--punkt_model', default=DEFAULT_PUNKT_MODEL,
+                        help='Punkt sentence model (default: the model trained on the corpus, shipped in punkt/).')
+    parser.add_argument('--train_punkt', action='store_true',
+                        help='Train a new Punkt model on the input letters and save it to --punkt_model before annotating.')
+    parser.add_argument('--cache', help='Optional SQLite file caching tagged sentences across runs.')
+    parser.add_argument('--profile', nargs='?', const='profile', metavar='REPORT_DIR',
+                        help='Write per-letter timing and counter reports (default directory: profile).')
+    args = parser.parse_args()
+
+    if args.train_punkt:
+        if os.path.abspath(args.punkt_model) == DEFAULT_PUNKT_MODEL:
+            parser.error('--train_punkt needs a --punkt_model path, so the shipped model is not overwritten')
+    elif not os.path.exists(args.punkt_model):
+        parser.error(f'no Punkt model at {args.punkt_model}; train one with scripts/train_punkt.py or --train_punkt')
+
+    global_language_identifier = train_language_models(args.lang_data_dir)
+    if args.train_punkt:
+        save_punkt_model(train_punkt_model(doc for filename, doc in iter_documents(args.input_dir)), args.punkt_model)
+        print(f'Trained the Punkt model on {args.input_dir} and saved it to {args.punkt_model}')
+    global_sentence_tokenizer = load_punkt_model(args.punkt_model)
+    cache = open_sentence_cache(args.cache, args.entity_dir, args.lang_data_dir) if args.cache else None
+    try:
+        process_directory(args.input_dir, args.output_dir, args.entity_dir, cache, args.profile)
+    finally:
+        if cache is not None:
+            print(f'Sentence cache: {cache.hits} hits, {cache.misses} misses; '
+                  f'languages: {cache.language_hits} hits, {cache.language_misses} misses')
+            cache.close()
 
-input_dir = '/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/bullingerproject/new_directory_with_lb_files'
-output_dir = '/Users/isabellecretton/Desktop/UGBERT/SEMESTER_4/CREATION-ANNOTATION/project/bullingerproject/new_directory_with_correct_files_cleaned'
-process_directory(input_dir, output_dir)
+if __name__ == "__main__":
+    main()
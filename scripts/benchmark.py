@@ -0,0 +1,231 @@
+"""
+Stage-level benchmark of the annotation pipeline.
+
+Runs the letters in `<lb_files_corrected` and `TEST/*.xml` through
+`SentenceTokenizer.process_paragraphs`, the code the annotation script
+runs, and times every stage separately through its profiler hooks: XML
+parsing, `preserve_lb_tags`, Punkt segmentation, cache lookups, entity
+tagging, sentence assembly, language identification, reconstruction and
+writing. With --cache the letters go through the sentence cache, so the
+golden check also covers the cached path. Results can be
+saved as JSON and compared against an earlier run, and the annotated
+letters can be checked against golden outputs to confirm that an optimized
+code path still produces identical annotations. Golden outputs are the
+annotated letters of a reference run kept with --output_dir.
+
+Example:
+    PYTHONPATH=.:lang_id python -m scripts.benchmark --save bench.json --output_dir golden/
+    PYTHONPATH=.:lang_id python -m scripts.benchmark --baseline bench.json --golden golden/
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import tempfile
+from contextlib import nullcontext
+from lxml import etree
+from scripts import SentenceTokenizer
+from scripts.NERTagger import EntityTagger
+from scripts.profiling import StageTimer
+from scripts.SentenceTokenizer import (process_paragraphs, open_sentence_cache, train_language_models, load_punkt_model,
+                                       DEFAULT_LANG_DATA_DIR, DEFAULT_PUNKT_MODEL)
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_INPUTS = [os.path.join(REPO_DIR, '<lb_files_corrected'), os.path.join(REPO_DIR, 'TEST', '*.xml')]
+STAGES = ['parse', 'preserve_lb_tags', 'punkt', 'cache', 'bio_tag', 'assemble', 'identify', 'reconstruct', 'write']
+
+
+class BenchmarkProfiler:
+    """The profiler hooks of process_paragraphs: stage times in a StageTimer, plus token and sentence counts."""
+
+    def __init__(self):
+        self.timer = StageTimer()
+        self.tokens = 0
+        self.sentences = 0
+
+    def stage(self, name):
+        return self.timer.stage(name)
+
+    def sentence(self, piece):
+        # Called once per sentence piece, cached or not
+        self.tokens += len(piece.split())
+        return nullcontext()
+
+    def count_sentences(self, count):
+        self.sentences += count
+
+
+def collect_files(inputs):
+    """Expand directories and glob patterns in @param inputs into a sorted list of XML files."""
+    files = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(glob.escape(pattern), '*.xml')
+        files.update(path for path in glob.glob(pattern) if path.endswith('.xml'))
+    return sorted(files)
+
+
+def output_name(input_file):
+    # Letters keep the name of their source directory, since TEST and the corpus share file names
+    return os.path.join(os.path.basename(os.path.dirname(os.path.abspath(input_file))), os.path.basename(input_file))
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def annotate_file(input_file, output_file, tagger, cache, profiler):
+    """Annotate one letter as SentenceTokenizer.process_directory does, timed by @param profiler."""
+    with profiler.stage('parse'):
+        doc = etree.parse(input_file)
+    process_paragraphs(doc, tagger, cache, profiler)
+    with profiler.stage('write'):
+        doc.write(output_file, pretty_print=True, xml_declaration=True, encoding='UTF-8')
+
+
+def run_benchmark(files, output_dir, entity_dir, lang_data_dir, punkt_model=DEFAULT_PUNKT_MODEL, cache=None):
+    profiler = BenchmarkProfiler()
+    timer = profiler.timer
+    SentenceTokenizer.global_sentence_tokenizer = load_punkt_model(punkt_model)
+    SentenceTokenizer.global_language_identifier = train_language_models(lang_data_dir)
+    tagger = EntityTagger(entity_dir)
+
+    per_file = {}
+    for input_file in files:
+        filename = output_name(input_file)
+        os.makedirs(os.path.dirname(os.path.join(output_dir, filename)), exist_ok=True)
+        started = time.perf_counter()
+        tokens, sentences = profiler.tokens, profiler.sentences
+        annotate_file(input_file, os.path.join(output_dir, filename), tagger, cache, profiler)
+        per_file[filename] = {'seconds': time.perf_counter() - started,
+                              'tokens': profiler.tokens - tokens, 'sentences': profiler.sentences - sentences}
+    total_tokens, total_sentences = profiler.tokens, profiler.sentences
+
+    total_seconds = sum(timer.totals[stage] for stage in STAGES)
+    results = {
+        'files': len(files),
+        'tokens': total_tokens,
+        'sentences': total_sentences,
+        'seconds': total_seconds,
+        'tokens_per_sec': total_tokens / total_seconds if total_seconds else 0.0,
+        'sentences_per_sec': total_sentences / total_seconds if total_seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {stage: {'seconds': timer.totals[stage],
+                           'tokens_per_sec': total_tokens / timer.totals[stage] if timer.totals[stage] else None,
+                           'sentences_per_sec': total_sentences / timer.totals[stage] if timer.totals[stage] else None}
+                   for stage in STAGES},
+        'per_file': per_file,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if cache is not None:
+        results['cache'] = {'hits': cache.hits, 'misses': cache.misses,
+                            'language_hits': cache.language_hits, 'language_misses': cache.language_misses}
+    return results
+
+
+def check_golden(files, output_dir, golden_dir):
+    """Return the letters whose annotated output differs from the one stored in @param golden_dir."""
+    differing = []
+    for input_file in files:
+        filename = output_name(input_file)
+        golden_file = os.path.join(golden_dir, filename)
+        with open(os.path.join(output_dir, filename), 'rb') as infile:
+            output = infile.read()
+        if not os.path.exists(golden_file):
+            differing.append(f'{filename} (no golden output)')
+            continue
+        with open(golden_file, 'rb') as infile:
+            if infile.read() != output:
+                differing.append(filename)
+    return differing
+
+
+def print_report(results, baseline=None):
+    print(f"{results['files']} files, {results['tokens']} tokens, {results['sentences']} sentences "
+          f"in {results['seconds']:.2f}s")
+    peak_rss = f"{results['peak_rss_mb']:.1f} MB" if results['peak_rss_mb'] is not None else 'n/a'
+    print(f"{results['tokens_per_sec']:.1f} tokens/sec, {results['sentences_per_sec']:.1f} sentences/sec, "
+          f"peak RSS {peak_rss}")
+    print(f"\n{'stage':<20}{'seconds':>10}{'share':>8}{'tokens/sec':>14}" + (f"{'vs baseline':>14}" if baseline else ''))
+    for stage in STAGES:
+        seconds = results['stages'][stage]['seconds']
+        share = seconds / results['seconds'] * 100 if results['seconds'] else 0.0
+        tokens_per_sec = results['stages'][stage]['tokens_per_sec'] or 0.0
+        line = f'{stage:<20}{seconds:>10.3f}{share:>7.1f}%{tokens_per_sec:>14.1f}'
+        if baseline:
+            baseline_seconds = baseline['stages'].get(stage, {}).get('seconds')
+            line += f'{seconds / baseline_seconds:>13.2f}x' if baseline_seconds else f"{'n/a':>14}"
+        print(line)
+    if 'cache' in results:
+        cache = results['cache']
+        print(f"\ncache: {cache['hits']} hits, {cache['misses']} misses; "
+              f"languages: {cache['language_hits']} hits, {cache['language_misses']} misses")
+    if baseline:
+        print(f"\ntotal: {results['seconds']:.2f}s vs {baseline['seconds']:.2f}s in baseline "
+              f"({results['seconds'] / baseline['seconds']:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the annotation pipeline stage by stage.')
+    parser.add_argument('inputs', nargs='*', default=DEFAULT_INPUTS, help='Letter directories or glob patterns.')
+    parser.add_argument('--limit', type=int, help='Only benchmark the first N letters.')
+    parser.add_argument('--entity_dir', default=os.path.join(REPO_DIR, 'entities'), help='Directory containing the extracted entity files.')
+    parser.add_argument('--lang_data_dir', default=DEFAULT_LANG_DATA_DIR, help='Directory with the language model training data.')
+    parser.add_argument('--punkt_model', default=DEFAULT_PUNKT_MODEL, help='Punkt sentence model (default: the shipped corpus model).')
+    parser.add_argument('--cache', help='Run through this SQLite sentence cache, as SentenceTokenizer --cache does.')
+    parser.add_argument('--output_dir', help='Keep the annotated letters here instead of a temporary directory.')
+    parser.add_argument('--save', help='Write the results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare against results saved earlier with --save.')
+    parser.add_argument('--golden', help='Directory with golden annotated letters to compare the output against.')
+    args = parser.parse_args()
+
+    files = collect_files(args.inputs)[:args.limit]
+    if not files:
+        parser.error('no XML files found')
+
+    cache = open_sentence_cache(args.cache, args.entity_dir, args.lang_data_dir) if args.cache else None
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_dir = args.output_dir or temp_dir
+            os.makedirs(output_dir, exist_ok=True)
+            results = run_benchmark(files, output_dir, args.entity_dir, args.lang_data_dir, args.punkt_model, cache)
+            differing = check_golden(files, output_dir, args.golden) if args.golden else []
+    finally:
+        if cache is not None:
+            cache.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as infile:
+            baseline = json.load(infile)
+    print_report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if args.golden:
+        if differing:
+            print(f'\nGolden check FAILED for {len(differing)} of {len(files)} letters:')
+            for filename in differing:
+                print(f'  {filename}')
+            sys.exit(1)
+        print(f'\nGolden check passed for {len(files)} letters.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Packed corpus archive: all letters of a directory in one indexed file.
+
+Opening hundreds of small XML files is slow on network storage, so a
+directory of letters can be packed into a single container file:
+
+    header  magic b'BLPK', format version, offset and length of the index
+    data    the bytes of every letter, back to back
+    index   JSON object mapping each file name to its [offset, length]
+
+A `CorpusPack` memory-maps the archive. A letter is read by its ID (the
+file name with or without '.xml') without touching the others, and
+`iter_letters` streams all letters in archive order. `iter_inputs`,
+`iter_documents` and `letter_names` take either a directory or a pack,
+which is how the annotation, entity extraction and sentence extraction
+scripts read their input.
+
+Example:
+    python scripts/corpus_pack.py pack '<lb_files_corrected' letters.pack
+    python scripts/corpus_pack.py unpack letters.pack restored/
+"""
+
+import io
+import os
+import json
+import mmap
+import struct
+import argparse
+from lxml import etree
+
+MAGIC = b'BLPK'
+VERSION = 1
+HEADER = struct.Struct('<4sHQQ')
+
+
+def is_pack(path):
+    """Whether @param path is a corpus pack rather than a directory of letters."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as infile:
+        return infile.read(len(MAGIC)) == MAGIC
+
+
+def write_pack(input_dir, pack_path):
+    """Pack the XML files of @param input_dir into @param pack_path. Returns the number of letters."""
+    filenames = sorted(filename for filename in os.listdir(input_dir) if filename.endswith('.xml'))
+    index = {}
+    with open(pack_path, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for filename in filenames:
+            with open(os.path.join(input_dir, filename), 'rb') as infile:
+                data = infile.read()
+            index[filename] = [outfile.tell(), len(data)]
+            outfile.write(data)
+        index_offset = outfile.tell()
+        index_data = json.dumps(index, ensure_ascii=False).encode('utf-8')
+        outfile.write(index_data)
+        # Fill in the index position last, so an interrupted write is not a valid pack
+        outfile.seek(0)
+        outfile.write(HEADER.pack(MAGIC, VERSION, index_offset, len(index_data)))
+    return len(index)
+
+
+class CorpusPack:
+    """Read-only, memory-mapped access to the letters of a pack file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, index_offset, index_length = HEADER.unpack_from(self._map)
+            if magic != MAGIC or index_offset == 0:
+                raise ValueError(f'{path} is not a corpus pack')
+            if version != VERSION:
+                raise ValueError(f'{path} has pack format version {version}, expected {VERSION}')
+            self.index = json.loads(self._map[index_offset:index_offset + index_length].decode('utf-8'))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, letter_id):
+        return self._filename(letter_id) in self.index
+
+    def names(self):
+        """File names of the packed letters, in archive order."""
+        return list(self.index)
+
+    def _filename(self, letter_id):
+        letter_id = str(letter_id)
+        return letter_id if letter_id.endswith('.xml') else f'{letter_id}.xml'
+
+    def read(self, letter_id):
+        """Return the bytes of one letter, e.g. read('1001') or read('1001.xml')."""
+        filename = self._filename(letter_id)
+        if filename not in self.index:
+            raise KeyError(f'No letter {letter_id} in {self.path}')
+        offset, length = self.index[filename]
+        return self._map[offset:offset + length]
+
+    def parse(self, letter_id):
+        """Parse one letter into an lxml ElementTree."""
+        return etree.parse(io.BytesIO(self.read(letter_id)))
+
+    def iter_letters(self):
+        """Yield (filename, bytes) for every letter, reading the archive front to back."""
+        for filename, (offset, length) in sorted(self.index.items(), key=lambda item: item[1][0]):
+            yield filename, self._map[offset:offset + length]
+
+    def unpack(self, output_dir, letter_ids=None):
+        """Write the letters (all, or only @param letter_ids) back as individual files."""
+        filenames = [self._filename(letter_id) for letter_id in letter_ids] if letter_ids else self.names()
+        # Check every ID first, so an unknown one leaves nothing half written
+        unknown = [filename for filename in filenames if filename not in self.index]
+        if unknown:
+            raise KeyError(f"No letters {', '.join(unknown)} in {self.path}")
+        os.makedirs(output_dir, exist_ok=True)
+        for filename in filenames:
+            with open(os.path.join(output_dir, filename), 'wb') as outfile:
+                outfile.write(self.read(filename))
+        return len(filenames)
+
+
+def letter_names(source):
+    """File names of the letters in @param source, a directory or a pack."""
+    if is_pack(source):
+        with CorpusPack(source) as pack:
+            return pack.names()
+    return [filename for filename in os.listdir(source) if filename.endswith('.xml')]
+
+
+def iter_inputs(source):
+    """
+    Yield (filename, input) for every letter in @param source, a directory or
+    a pack. The input is a path or an in-memory file, ready for etree.parse.
+    """
+    if is_pack(source):
+        with CorpusPack(source) as pack:
+            for filename, data in pack.iter_letters():
+                yield filename, io.BytesIO(data)
+        return
+    for filename in os.listdir(source):
+        if filename.endswith('.xml'):
+            yield filename, os.path.join(source, filename)
+
+
+def iter_documents(source):
+    """Yield (filename, parsed tree) for every letter in @param source, a directory or a pack."""
+    for filename, letter in iter_inputs(source):
+        yield filename, etree.parse(letter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack letters into one indexed archive, or restore them.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack_command = commands.add_parser('pack', help='Pack the XML files of a directory.')
+    pack_command.add_argument('input_dir', help='Directory containing the letters.')
+    pack_command.add_argument('pack', help='Pack file to write.')
+    unpack_command = commands.add_parser('unpack', help='Restore the letters of a pack as individual files.')
+    unpack_command.add_argument('pack', help='Pack file to read.')
+    unpack_command.add_argument('output_dir', help='Directory for the restored letters.')
+    unpack_command.add_argument('letters', nargs='*', help='Only restore these letter IDs.')
+    list_command = commands.add_parser('list', help='List the letters of a pack.')
+    list_command.add_argument('pack', help='Pack file to read.')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        count = write_pack(args.input_dir, args.pack)
+        print(f'Packed {count} letters into {args.pack}')
+    elif args.command == 'unpack':
+        with CorpusPack(args.pack) as pack:
+            unknown = [letter_id for letter_id in args.letters if letter_id not in pack]
+            if unknown:
+                parser.error(f"no letters {', '.join(unknown)} in {args.pack}")
+            count = pack.unpack(args.output_dir, args.letters)
+        print(f'Restored {count} letters to {args.output_dir}')
+    else:
+        with CorpusPack(args.pack) as pack:
+            for filename in pack.names():
+                print(filename)
+
+
+if __name__ == '__main__':
+    main()
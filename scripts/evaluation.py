@@ -0,0 +1,124 @@
+"""
+Evaluation of the entity tagger against the gold sentence labels.
+
+A row is a match if the gold label equals the tagger's label and the
+tagged sentence equals the original sentence (ignoring case and outer
+whitespace). It is a false positive if only the labels agree and a false
+negative otherwise. Rows whose original sentence contains an automatic
+person name, or whose tagged sentence contains an automatic place name,
+are not checked.
+
+All checks are column operations on pandas DataFrames. Input is consumed
+chunk by chunk, so CSV files larger than memory are evaluated in one
+streaming pass. Mismatches are written as each chunk is classified, in
+input order.
+"""
+
+from itertools import islice
+import numpy as np
+import pandas as pd
+
+AUTO_PERSON = '<persName type="auto_name">'
+AUTO_PLACE = '<placeName type="auto_name">'
+OUTCOMES = ['match', 'false_positive', 'false_negative']
+MISMATCH_TYPES = {'false_positive': 'False Positive', 'false_negative': 'False Negative'}
+DEFAULT_COLUMNS = {
+    'label_column': 'Label',
+    'tagger_column': 'My Tagger Entity',
+    'filename_column': 'Filename',
+    'sentence_column': 'Sentence',
+    'tagged_sentence_column': 'Tagged Sentence',
+}
+
+
+def classify(df, label_column, tagger_column, sentence_column, tagged_sentence_column):
+    """Return the outcome of every checked row of @param df, indexed like @param df."""
+    sentences = df[sentence_column].fillna('').astype(str)
+    tagged_sentences = df[tagged_sentence_column].fillna('').astype(str)
+    checked = (~sentences.str.contains(AUTO_PERSON, regex=False)
+               & ~tagged_sentences.str.contains(AUTO_PLACE, regex=False))
+    same_label = df[label_column] == df[tagger_column]
+    same_sentence = sentences.str.strip().str.lower() == tagged_sentences.str.strip().str.lower()
+    outcomes = np.select([same_label & same_sentence, same_label], OUTCOMES[:2], OUTCOMES[2])
+    return pd.Series(outcomes, index=df.index)[checked]
+
+
+def count_outcomes(filenames, outcomes):
+    """Count the outcomes per file; returns a DataFrame indexed by filename with one column per outcome."""
+    counts = outcomes.groupby([filenames.loc[outcomes.index], outcomes]).size()
+    return counts.unstack(fill_value=0).reindex(columns=OUTCOMES, fill_value=0)
+
+
+def compute_metrics(counts):
+    """Add accuracy, precision, recall and F1 (as fractions) to a DataFrame of outcome counts."""
+    counts = counts.astype(float)
+    total = counts[OUTCOMES].sum(axis=1)
+    precision = counts['match'] / (counts['match'] + counts['false_positive'])
+    recall = counts['match'] / (counts['match'] + counts['false_negative'])
+    return counts.assign(
+        total_checked=total,
+        accuracy=counts['match'] / total,
+        precision=precision,
+        recall=recall,
+        f1_score=(2 * precision * recall / (precision + recall)).where(precision + recall > 0, 0.0),
+    )
+
+
+def evaluate(chunks, mismatch_file=None, **columns):
+    """
+    Evaluate an iterable of DataFrame @param chunks in a single pass.
+
+    Returns (per_file, overall): a DataFrame of counts and metrics per file
+    and a Series with the same columns for all files together. If
+    @param mismatch_file is given, false positives and false negatives are
+    appended to it as each chunk is processed.
+    """
+    columns = {**DEFAULT_COLUMNS, **columns}
+    filename_column = columns['filename_column']
+    counts = pd.DataFrame(columns=OUTCOMES, dtype='int64')
+    mismatch_out = open(mismatch_file, 'w', encoding='utf-8', newline='') if mismatch_file else None
+    try:
+        if mismatch_out:
+            mismatch_out.write('filename,sentence,tagged_sentence,type\n')
+        for df in chunks:
+            df = df[df[filename_column].notna()]
+            outcomes = classify(df, columns['label_column'], columns['tagger_column'],
+                                columns['sentence_column'], columns['tagged_sentence_column'])
+            counts = counts.add(count_outcomes(df[filename_column], outcomes), fill_value=0)
+            if mismatch_out:
+                mismatched = outcomes[outcomes != 'match']
+                rows = df.loc[mismatched.index]
+                pd.DataFrame({
+                    'filename': rows[filename_column],
+                    'sentence': rows[columns['sentence_column']],
+                    'tagged_sentence': rows[columns['tagged_sentence_column']],
+                    'type': mismatched.map(MISMATCH_TYPES),
+                }).to_csv(mismatch_out, header=False, index=False)
+    finally:
+        if mismatch_out:
+            mismatch_out.close()
+
+    counts = counts[counts[OUTCOMES].sum(axis=1) > 0]
+    per_file = compute_metrics(counts)
+    overall = compute_metrics(counts[OUTCOMES].sum().to_frame().T).iloc[0]
+    return per_file, overall
+
+
+def evaluate_csv(csv_file, chunksize=None, mismatch_file=None, **columns):
+    """Evaluate a CSV file, streamed in chunks of @param chunksize rows if given."""
+    chunks = pd.read_csv(csv_file, chunksize=chunksize) if chunksize else [pd.read_csv(csv_file)]
+    return evaluate(chunks, mismatch_file, **columns)
+
+
+def _row_chunks(rows, chunksize):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, chunksize))
+        if not batch:
+            return
+        yield pd.DataFrame(batch)
+
+
+def evaluate_rows(rows, chunksize=10000, mismatch_file=None, **columns):
+    """Evaluate an iterable of row dicts, e.g. straight from the tagger, without writing a CSV first."""
+    return evaluate(_row_chunks(rows, chunksize), mismatch_file, **columns)
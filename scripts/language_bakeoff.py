@@ -0,0 +1,197 @@
+"""
+Throughput and accuracy bake-off of the language detector backends.
+
+Every backend of `scripts.language_detectors` is run over two sentence
+sets: the gold sentences of `<lb_files_corrected`, labelled by their
+xml:lang attribute, and the line texts after each <lb/> in `TEST/*.xml`,
+the unit TEST/test.py detects on, which have no labels. For every backend
+and set it reports sentences/sec of a `detect_batch` call over the whole
+set, latency percentiles of single `detect` calls, and accuracy against
+the gold labels, overall and per language.
+
+The pipeline does not run charlm on plain text: it scores each sentence as
+the markup it writes into <s>, with the <lb/> elements and the entity tags
+of EntityTagger. With --pipeline_input, backends used that way score the
+same markup, built by the pipeline's own segmentation and tagging code, so
+their accuracy is the production accuracy. Tagging every sentence is slow,
+so by default they score plain text and the report says so.
+
+Example:
+    PYTHONPATH=.:lang_id python -m scripts.language_bakeoff --save bakeoff.json
+    PYTHONPATH=.:lang_id python -m scripts.language_bakeoff --pipeline_input --limit 100
+"""
+
+import os
+import json
+import time
+import argparse
+import platform
+from collections import Counter
+from lxml import etree
+from scripts.benchmark import collect_files, REPO_DIR
+from scripts.language_detectors import BACKENDS, load_detector
+from scripts.NERTagger import EntityTagger
+from scripts.SentenceTokenizer import (XML_LANG, DEFAULT_LANG_DATA_DIR, preserve_lb_tags, segment_paragraph,
+                                       assemble_sentences, sentence_markup)
+
+DEFAULT_GOLD = [os.path.join(REPO_DIR, '<lb_files_corrected')]
+DEFAULT_TEST = [os.path.join(REPO_DIR, 'TEST', '*.xml')]
+PERCENTILES = [50, 90, 99]
+
+
+def _normalize(text):
+    return ' '.join(text.split())
+
+
+def pipeline_markup(text_chunks, entity_tagger):
+    """The markup SentenceTokenizer scores for a sentence made of @param text_chunks (text and <lb> elements)."""
+    sentences = assemble_sentences(segment_paragraph(text_chunks), entity_tagger)
+    return ''.join(sentence_markup(pieces, entity_tagger) for pieces in sentences)
+
+
+def gold_sentences(files, entity_tagger=None):
+    """
+    Return (text, markup, language) triples for every labelled <s> element of
+    @param files. The markup is only built if @param entity_tagger is given.
+    """
+    sentences = []
+    for input_file in files:
+        if entity_tagger is not None:
+            entity_tagger.start_document()
+        for sentence in etree.parse(input_file).iter('s'):
+            text = _normalize(''.join(sentence.itertext()))
+            if text and sentence.get(XML_LANG):
+                markup = pipeline_markup(preserve_lb_tags(sentence), entity_tagger) if entity_tagger else None
+                sentences.append((text, markup, sentence.get(XML_LANG)))
+    return sentences
+
+
+def line_sentences(files, entity_tagger=None):
+    """Return (text, markup, None) triples for the text after every <lb/> in the paragraphs of @param files."""
+    sentences = []
+    for input_file in files:
+        if entity_tagger is not None:
+            entity_tagger.start_document()
+        for lb in etree.parse(input_file).xpath('//div/p//lb'):
+            text = _normalize(lb.tail or '')
+            if text:
+                sentences.append((text, pipeline_markup([text], entity_tagger) if entity_tagger else None, None))
+    return sentences
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an ascending list
+    if not sorted_values:
+        return None
+    rank = max(1, -(-p * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def run_backend(detector, sentences):
+    """Time @param detector on @param sentences and score it against their labels."""
+    # Backends the pipeline runs on markup score it whenever it was built
+    use_markup = detector.scores_markup and all(markup is not None for text, markup, language in sentences)
+    texts = [markup if use_markup else text for text, markup, language in sentences]
+
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        detector.detect(text)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    start = time.perf_counter()
+    predictions = detector.detect_batch(texts)
+    batch_seconds = time.perf_counter() - start
+
+    results = {
+        'input': 'markup' if use_markup else 'text',
+        'sentences': len(texts),
+        'batch_seconds': batch_seconds,
+        'sentences_per_sec': len(texts) / batch_seconds if batch_seconds else None,
+        'latency_ms': {f'p{p}': percentile(latencies, p) * 1000 if latencies else None for p in PERCENTILES},
+        'predicted': dict(Counter(predictions)),
+        'accuracy': None,
+        'accuracy_per_language': {},
+    }
+    labelled = [(language, prediction) for (text, markup, language), prediction in zip(sentences, predictions) if language]
+    if labelled:
+        results['accuracy'] = sum(language == prediction for language, prediction in labelled) / len(labelled)
+        totals = Counter(language for language, prediction in labelled)
+        correct = Counter(language for language, prediction in labelled if language == prediction)
+        results['accuracy_per_language'] = {language: correct[language] / totals[language] for language in sorted(totals)}
+    return results
+
+
+def run_bakeoff(backends, sentence_sets, lang_data_dir):
+    results = {'backends': {}, 'python': platform.python_version(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    for name in backends:
+        start = time.perf_counter()
+        detector = load_detector(name, lang_data_dir)
+        # The first call may load models lazily; keep it out of the measurements
+        detector.detect('Warm up')
+        backend_results = {'setup_seconds': time.perf_counter() - start}
+        for set_name, sentences in sentence_sets.items():
+            backend_results[set_name] = run_backend(detector, sentences)
+        results['backends'][name] = backend_results
+    return results
+
+
+def _format(value, spec):
+    return format(value, spec) if value is not None else 'n/a'
+
+
+def print_report(results, set_names):
+    for set_name in set_names:
+        print(f'\n{set_name}')
+        print(f"{'backend':<14}{'input':<8}{'sentences':>10}{'sent/sec':>12}"
+              + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'accuracy':>10}  per language")
+        for name, backend_results in results['backends'].items():
+            stats = backend_results[set_name]
+            accuracy = f"{stats['accuracy'] * 100:.2f}%" if stats['accuracy'] is not None else 'n/a'
+            per_language = ', '.join(f'{language} {value * 100:.2f}%'
+                                     for language, value in stats['accuracy_per_language'].items())
+            line = (f"{name:<14}{stats['input']:<8}{stats['sentences']:>10}{_format(stats['sentences_per_sec'], '.1f'):>12}"
+                    + ''.join(f"{_format(stats['latency_ms'][f'p{p}'], '.3f'):>10}" for p in PERCENTILES)
+                    + f'{accuracy:>10}  {per_language}')
+            print(line.rstrip())
+    differing = [name for name, backend_results in results['backends'].items()
+                 if BACKENDS[name].scores_markup and any(backend_results[set_name]['input'] == 'text' for set_name in set_names)]
+    if differing:
+        print(f"\nnote: {', '.join(differing)} scored plain text, but the pipeline scores the tagged sentence markup; "
+              'use --pipeline_input to measure its production accuracy')
+    print('\nsetup: ' + ', '.join(f"{name} {backend_results['setup_seconds']:.2f}s"
+                                  for name, backend_results in results['backends'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the language detector backends on speed and accuracy.')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS), help='Backends to compare.')
+    parser.add_argument('--gold', nargs='*', default=DEFAULT_GOLD, help='Annotated letters whose xml:lang labels are the gold standard.')
+    parser.add_argument('--test', nargs='*', default=DEFAULT_TEST, help='Unannotated letters, detected line by line.')
+    parser.add_argument('--limit', type=int, help='Only use the first N letters of each set.')
+    parser.add_argument('--lang_data_dir', default=DEFAULT_LANG_DATA_DIR, help='Directory with the language model training data.')
+    parser.add_argument('--pipeline_input', action='store_true',
+                        help='Let backends the pipeline runs on tagged markup (charlm) score that markup; tags every sentence, which is slow.')
+    parser.add_argument('--entity_dir', default=os.path.join(REPO_DIR, 'entities'), help='Directory containing the extracted entity files.')
+    parser.add_argument('--save', help='Write the results as JSON to this file.')
+    args = parser.parse_args()
+
+    entity_tagger = EntityTagger(args.entity_dir) if args.pipeline_input else None
+    sentence_sets = {
+        'gold': gold_sentences(collect_files(args.gold)[:args.limit], entity_tagger),
+        'test': line_sentences(collect_files(args.test)[:args.limit], entity_tagger),
+    }
+    if not any(sentence_sets.values()):
+        parser.error('no sentences found')
+
+    results = run_bakeoff(args.backends, sentence_sets, args.lang_data_dir)
+    print_report(results, sentence_sets)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as outfile:
+            json.dump(results, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
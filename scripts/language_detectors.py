@@ -0,0 +1,84 @@
+"""
+Language detectors behind a common interface.
+
+Every detector maps a text to 'de', 'la' or 'unk' with `detect`, and a
+list of texts to a list of codes with `detect_batch`. Two backends are
+available: 'charlm', the character-level models of `LanguageIdentifier`
+used by SentenceTokenizer, and 'langdetect', the approach of TEST/test.py.
+`load_detector` builds a backend by name.
+"""
+
+from abc import ABC, abstractmethod
+from scripts.SentenceTokenizer import train_language_models, DEFAULT_LANG_DATA_DIR
+
+
+class LanguageDetector(ABC):
+    """Base class of the detector backends; subclasses implement `detect`."""
+
+    name = None
+    # Whether the annotation pipeline runs the backend on tagged sentence markup rather than plain text
+    scores_markup = False
+
+    @abstractmethod
+    def detect(self, text):
+        """Return the language code of @param text."""
+
+    def detect_batch(self, texts):
+        """Return the language codes of @param texts, in order."""
+        return [self.detect(text) for text in texts]
+
+
+class CharLMDetector(LanguageDetector):
+    """Pick the character-level model with the lowest perplexity, as the annotation pipeline does."""
+
+    name = 'charlm'
+    # SentenceTokenizer scores the sentence with its <lb/> and entity tags
+    scores_markup = True
+
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+    @classmethod
+    def from_data(cls, lang_data_dir=DEFAULT_LANG_DATA_DIR, ngram_order=3, smoothing=0.1):
+        return cls(train_language_models(lang_data_dir, ngram_order, smoothing))
+
+    def detect(self, text):
+        if not text:
+            return 'unk'
+        return self.identifier.identify(text).lower()
+
+    def detect_batch(self, texts):
+        identify = self.identifier.identify
+        return [identify(text).lower() if text else 'unk' for text in texts]
+
+
+class LangdetectDetector(LanguageDetector):
+    """langdetect, with every language other than German counted as Latin, as in TEST/test.py."""
+
+    name = 'langdetect'
+
+    def __init__(self, seed=0):
+        # Imported here so the other backends work without langdetect installed
+        from langdetect import DetectorFactory, detect, LangDetectException
+        # langdetect is randomized; a fixed seed makes its results reproducible
+        DetectorFactory.seed = seed
+        self._detect = detect
+        self._error = LangDetectException
+
+    def detect(self, text):
+        try:
+            return 'de' if self._detect(text) == 'de' else 'la'
+        except self._error:
+            return 'unk'
+
+
+BACKENDS = {detector.name: detector for detector in [CharLMDetector, LangdetectDetector]}
+
+
+def load_detector(name, lang_data_dir=DEFAULT_LANG_DATA_DIR):
+    """Build the detector backend called @param name."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown language detector '{name}', expected one of: {', '.join(BACKENDS)}")
+    if name == CharLMDetector.name:
+        return CharLMDetector.from_data(lang_data_dir)
+    return BACKENDS[name]()
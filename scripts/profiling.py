@@ -0,0 +1,148 @@
+"""
+Timing and hot-path counters for annotation runs.
+
+`AnnotationProfiler` is switched on with `SentenceTokenizer.py --profile`.
+It writes one JSON report per letter, with the number of <s> sentences
+and of tagged Punkt pieces, stage times, the counters of
+`EntityTagger.stats` and `CharLM.scored_ngrams`, the hit rate of the
+tagger's per-document hot set, and the slowest pieces. It also writes a
+corpus summary listing the slowest letters and pieces. When no profiler
+is given, `stage` and `timed_sentence` return a shared no-op context
+manager, so unprofiled runs pay nothing beyond a None check.
+"""
+
+import os
+import json
+import heapq
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+_UNTIMED = nullcontext()
+TAGGER_COUNTERS = ['positions', 'ngrams', 'lev_distance_calls', 'exact_hits', 'fuzzy_hits',
+                   'hot_set_hits', 'lev_distance_avoided']
+
+
+def hot_set_hit_rate(counters):
+    """Share of entity matches served from the per-document hot set instead of the gazetteer."""
+    matches = counters['hot_set_hits'] + counters['exact_hits'] + counters['fuzzy_hits']
+    return counters['hot_set_hits'] / matches if matches else None
+
+
+class StageTimer:
+    """Accumulate exclusive wall-clock time per stage; nested stages are not counted twice."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._nested = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.totals[name] += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+
+def stage(profiler, name):
+    """Time the enclosed block as stage @param name if @param profiler is set."""
+    return profiler.stage(name) if profiler is not None else _UNTIMED
+
+
+def timed_sentence(profiler, sentence):
+    """Record how long the enclosed block spends on @param sentence if @param profiler is set."""
+    return profiler.sentence(sentence) if profiler is not None else _UNTIMED
+
+
+class AnnotationProfiler:
+    """Collect per-letter stage times, tagger and language model counters, and slow sentences."""
+
+    def __init__(self, report_dir, entity_tagger, language_identifier, slowest=10):
+        self.report_dir = report_dir
+        self.entity_tagger = entity_tagger
+        self.language_identifier = language_identifier
+        self.slowest = slowest
+        os.makedirs(report_dir, exist_ok=True)
+        entity_tagger.stats = Counter()
+        self.letters = []
+        self.slowest_sentences = []
+        self.stage_totals = defaultdict(float)
+        self.counter_totals = Counter()
+        self._filename = None
+
+    def start_file(self, filename):
+        self._filename = filename
+        self._started = time.perf_counter()
+        self._timer = StageTimer()
+        self._sentences = []
+        self._sentence_count = 0
+        self._tagger_stats = Counter(self.entity_tagger.stats)
+        self._scored_ngrams = self.language_identifier.count_scored_ngrams()
+
+    def stage(self, name):
+        return self._timer.stage(name)
+
+    @contextmanager
+    def sentence(self, sentence):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sentences.append((time.perf_counter() - start, sentence))
+
+    def count_sentences(self, count):
+        """Add @param count assembled <s> sentences to the current letter."""
+        self._sentence_count += count
+
+    def finish_file(self):
+        """Write the report of the current letter and add it to the corpus totals."""
+        seconds = time.perf_counter() - self._started
+        counters = Counter({name: self.entity_tagger.stats[name] - self._tagger_stats[name] for name in TAGGER_COUNTERS})
+        counters['scored_ngrams'] = self.language_identifier.count_scored_ngrams() - self._scored_ngrams
+        slowest_sentences = heapq.nlargest(self.slowest, self._sentences, key=lambda item: item[0])
+        report = {
+            'file': self._filename,
+            'seconds': seconds,
+            'sentences': self._sentence_count,
+            'pieces': len(self._sentences),
+            'stages': dict(self._timer.totals),
+            'counters': dict(counters),
+            'hot_set_hit_rate': hot_set_hit_rate(counters),
+            'slowest_sentences': [{'seconds': sentence_seconds, 'sentence': sentence}
+                                  for sentence_seconds, sentence in slowest_sentences],
+        }
+        with open(os.path.join(self.report_dir, f'{self._filename}.json'), 'w', encoding='utf-8') as outfile:
+            json.dump(report, outfile, ensure_ascii=False, indent=2)
+
+        self.letters.append({'file': self._filename, 'seconds': seconds,
+                             'sentences': self._sentence_count, 'pieces': len(self._sentences)})
+        for stage_name, stage_seconds in self._timer.totals.items():
+            self.stage_totals[stage_name] += stage_seconds
+        self.counter_totals.update(counters)
+        self.slowest_sentences = heapq.nlargest(
+            self.slowest,
+            self.slowest_sentences + [{'file': self._filename, 'seconds': sentence_seconds, 'sentence': sentence}
+                                      for sentence_seconds, sentence in slowest_sentences],
+            key=lambda item: item['seconds'])
+        self._filename = None
+
+    def write_summary(self):
+        """Write the corpus summary and return its path."""
+        summary = {
+            'files': len(self.letters),
+            'seconds': sum(letter['seconds'] for letter in self.letters),
+            'stages': dict(self.stage_totals),
+            'counters': dict(self.counter_totals),
+            'hot_set_hit_rate': hot_set_hit_rate(self.counter_totals),
+            'slowest_letters': heapq.nlargest(self.slowest, self.letters, key=lambda letter: letter['seconds']),
+            'slowest_sentences': self.slowest_sentences,
+        }
+        path = os.path.join(self.report_dir, 'summary.json')
+        with open(path, 'w', encoding='utf-8') as outfile:
+            json.dump(summary, outfile, ensure_ascii=False, indent=2)
+        return path
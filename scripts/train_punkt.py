@@ -0,0 +1,33 @@
+"""
+Train the Punkt sentence model of the annotation pipeline.
+
+Punkt learns the abbreviations, collocations and sentence starters of the
+corpus from unannotated text, so "d.", "S." or "M." do not end a sentence.
+The model in punkt/punkt_model.json, which SentenceTokenizer loads by
+default, was trained on `<lb_files_corrected`. Retrain it when the corpus
+changes, or train a separate model for another collection and pass it
+with --punkt_model.
+
+Example:
+    PYTHONPATH=.:lang_id python scripts/train_punkt.py '<lb_files_corrected'
+    PYTHONPATH=.:lang_id python scripts/train_punkt.py letters.pack --output other_model.json
+"""
+
+import argparse
+from scripts.corpus_pack import iter_documents
+from scripts.SentenceTokenizer import train_punkt_model, save_punkt_model, DEFAULT_PUNKT_MODEL
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the Punkt sentence model on a corpus of letters.')
+    parser.add_argument('inputs', nargs='+', help='Directories or corpus packs containing the training letters.')
+    parser.add_argument('--output', default=DEFAULT_PUNKT_MODEL, help='Where to save the model (default: the shipped model).')
+    args = parser.parse_args()
+
+    params = train_punkt_model(doc for source in args.inputs for filename, doc in iter_documents(source))
+    save_punkt_model(params, args.output)
+    print(f"Trained the Punkt model on {', '.join(args.inputs)} and saved it to {args.output}")
+
+
+if __name__ == '__main__':
+    main()